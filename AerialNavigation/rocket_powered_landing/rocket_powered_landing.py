@@ -12,10 +12,11 @@ by Michael Szmuk and Behcet Acıkmese.
 - EmbersArc/SuccessiveConvexificationFreeFinalTime: Implementation of "Successive Convexification for 6-DoF Mars Rocket Powered Landing with Free-Final-Time" https://github.com/EmbersArc/SuccessiveConvexificationFreeFinalTime
 
 """
+import math
 import warnings
 from time import time
 import numpy as np
-from scipy.integrate import odeint
+from numba import njit, prange
 import cvxpy
 import matplotlib.pyplot as plt
 
@@ -31,12 +32,191 @@ W_DELTA = 1e-3  # difference in state/input
 W_DELTA_SIGMA = 1e-1  # difference in flight time
 W_NU = 1e5  # virtual control
 
-solver = 'ECOS'
+# CLARABEL is faster on this SOCP; fall back to ECOS if it is not installed
+solver = 'CLARABEL' if 'CLARABEL' in cvxpy.installed_solvers() else 'ECOS'
 verbose_solver = False
 
 show_animation = True
 
 
+@njit(cache=True, fastmath=True, error_model='numpy')
+def dynamics_core(x, u, f, A, B):
+    """
+    Evaluate the dynamics f(x, u) and the Jacobians A = df/dx and B = df/du
+    in one pass, sharing the rotation matrix and quaternion terms between them.
+
+    Only the structural non-zeros of A and B are written, so both have to be
+    zero-initialized by the caller.
+
+    Compiled with the NumPy error model: a zero thrust or mass gives NaN
+    entries, as the NumPy version did, instead of raising ZeroDivisionError
+    inside the jitted (and parallel) callers.
+    """
+    m = x[0]
+    vx = x[4]
+    vy = x[5]
+    vz = x[6]
+    q0 = x[7]
+    q1 = x[8]
+    q2 = x[9]
+    q3 = x[10]
+    wx = x[11]
+    wy = x[12]
+    wz = x[13]
+    ux = u[0]
+    uy = u[1]
+    uz = u[2]
+
+    inv_m = 1. / m
+    two_inv_m = 2. * inv_m
+    T = math.sqrt(ux * ux + uy * uy + uz * uz)
+
+    # rotation matrix from body to inertial frame
+    q01, q02, q03 = q0 * q1, q0 * q2, q0 * q3
+    q11, q12, q13 = q1 * q1, q1 * q2, q1 * q3
+    q22, q23, q33 = q2 * q2, q2 * q3, q3 * q3
+    c00 = 1. - 2. * (q22 + q33)
+    c01 = 2. * (q12 - q03)
+    c02 = 2. * (q02 + q13)
+    c10 = 2. * (q12 + q03)
+    c11 = 1. - 2. * (q11 + q33)
+    c12 = 2. * (q23 - q01)
+    c20 = 2. * (q13 - q02)
+    c21 = 2. * (q01 + q23)
+    c22 = 1. - 2. * (q11 + q22)
+
+    # thrust acceleration in inertial frame
+    ax = (c00 * ux + c01 * uy + c02 * uz) * inv_m
+    ay = (c10 * ux + c11 * uy + c12 * uz) * inv_m
+    az = (c20 * ux + c21 * uy + c22 * uz) * inv_m
+
+    hq0, hq1, hq2, hq3 = 0.5 * q0, 0.5 * q1, 0.5 * q2, 0.5 * q3
+    hwx, hwy, hwz = 0.5 * wx, 0.5 * wy, 0.5 * wz
+
+    # f(x, u)
+    f[0] = -0.01 * T
+    f[1] = vx
+    f[2] = vy
+    f[3] = vz
+    f[4] = ax - 1.
+    f[5] = ay
+    f[6] = az
+    f[7] = -hq1 * wx - hq2 * wy - hq3 * wz
+    f[8] = hq0 * wx + hq2 * wz - hq3 * wy
+    f[9] = hq0 * wy - hq1 * wz + hq3 * wx
+    f[10] = hq0 * wz + hq1 * wy - hq2 * wx
+    f[11] = 0.
+    f[12] = uz
+    f[13] = -uy
+
+    # df/dx
+    A[1, 4] = 1.
+    A[2, 5] = 1.
+    A[3, 6] = 1.
+
+    A[4, 0] = -ax * inv_m
+    A[4, 7] = two_inv_m * (q2 * uz - q3 * uy)
+    A[4, 8] = two_inv_m * (q2 * uy + q3 * uz)
+    A[4, 9] = two_inv_m * (q0 * uz + q1 * uy - 2. * q2 * ux)
+    A[4, 10] = two_inv_m * (-q0 * uy + q1 * uz - 2. * q3 * ux)
+
+    A[5, 0] = -ay * inv_m
+    A[5, 7] = two_inv_m * (-q1 * uz + q3 * ux)
+    A[5, 8] = two_inv_m * (-q0 * uz - 2. * q1 * uy + q2 * ux)
+    A[5, 9] = two_inv_m * (q1 * ux + q3 * uz)
+    A[5, 10] = two_inv_m * (q0 * ux + q2 * uz - 2. * q3 * uy)
+
+    A[6, 0] = -az * inv_m
+    A[6, 7] = two_inv_m * (q1 * uy - q2 * ux)
+    A[6, 8] = two_inv_m * (q0 * uy - 2. * q1 * uz + q3 * ux)
+    A[6, 9] = two_inv_m * (-q0 * ux - 2. * q2 * uz + q3 * uy)
+    A[6, 10] = two_inv_m * (q1 * ux + q2 * uy)
+
+    A[7, 8] = -hwx
+    A[7, 9] = -hwy
+    A[7, 10] = -hwz
+    A[7, 11] = -hq1
+    A[7, 12] = -hq2
+    A[7, 13] = -hq3
+
+    A[8, 7] = hwx
+    A[8, 9] = hwz
+    A[8, 10] = -hwy
+    A[8, 11] = hq0
+    A[8, 12] = -hq3
+    A[8, 13] = hq2
+
+    A[9, 7] = hwy
+    A[9, 8] = -hwz
+    A[9, 10] = hwx
+    A[9, 11] = hq3
+    A[9, 12] = hq0
+    A[9, 13] = -hq1
+
+    A[10, 7] = hwz
+    A[10, 8] = hwy
+    A[10, 9] = -hwx
+    A[10, 11] = -hq2
+    A[10, 12] = hq1
+    A[10, 13] = hq0
+
+    # df/du
+    s = -0.01 / T
+    B[0, 0] = s * ux
+    B[0, 1] = s * uy
+    B[0, 2] = s * uz
+
+    B[4, 0] = c00 * inv_m
+    B[4, 1] = c01 * inv_m
+    B[4, 2] = c02 * inv_m
+    B[5, 0] = c10 * inv_m
+    B[5, 1] = c11 * inv_m
+    B[5, 2] = c12 * inv_m
+    B[6, 0] = c20 * inv_m
+    B[6, 1] = c21 * inv_m
+    B[6, 2] = c22 * inv_m
+
+    B[12, 2] = 1.
+    B[13, 1] = -1.
+
+
+@njit(cache=True, fastmath=True)
+def A_dot(A, Y, out):
+    """
+    Compute out = A @ Y using only the structural non-zeros of the state
+    Jacobian written by dynamics_core:
+
+    - rows 1-3: the velocity entries A[i, i + 3]
+    - rows 4-6: the mass and quaternion columns 0 and 7-10
+    - rows 7-10: the quaternion and angular velocity columns 7-13
+    - rows 0 and 11-13 are zero
+    """
+    for j in range(Y.shape[1]):
+        y0 = Y[0, j]
+        y7 = Y[7, j]
+        y8 = Y[8, j]
+        y9 = Y[9, j]
+        y10 = Y[10, j]
+        y11 = Y[11, j]
+        y12 = Y[12, j]
+        y13 = Y[13, j]
+
+        out[0, j] = 0.
+        out[1, j] = A[1, 4] * Y[4, j]
+        out[2, j] = A[2, 5] * Y[5, j]
+        out[3, j] = A[3, 6] * Y[6, j]
+        for i in range(4, 7):
+            out[i, j] = A[i, 0] * y0 + A[i, 7] * y7 + A[i, 8] * y8 + \
+                A[i, 9] * y9 + A[i, 10] * y10
+        for i in range(7, 11):
+            out[i, j] = A[i, 7] * y7 + A[i, 8] * y8 + A[i, 9] * y9 + \
+                A[i, 10] * y10 + A[i, 11] * y11 + A[i, 12] * y12 + \
+                A[i, 13] * y13
+        out[11, j] = 0.
+        out[12, j] = 0.
+        out[13, j] = 0.
+
+
 class Rocket_Model_6DoF:
     """
     A 6 degree of freedom rocket landing problem.
@@ -61,19 +241,21 @@ class Rocket_Model_6DoF:
         # State constraints
         self.r_I_final = np.array((0., 0., 0.))
         self.v_I_final = np.array((-1e-1, 0., 0.))
-        self.q_B_I_final = self.euler_to_quat((0, 0, 0))
+        self.q_B_I_final = np.empty(4)
+        self.euler_to_quat(np.zeros(3), self.q_B_I_final)
         self.w_B_final = np.deg2rad(np.array((0., 0., 0.)))
 
-        self.w_B_max = np.deg2rad(60)
+        self.w_B_max = math.radians(60)
 
         # Angles
         max_gimbal = 20
         max_angle = 90
         glidelslope_angle = 20
 
-        self.tan_delta_max = np.tan(np.deg2rad(max_gimbal))
-        self.cos_theta_max = np.cos(np.deg2rad(max_angle))
-        self.tan_gamma_gs = np.tan(np.deg2rad(glidelslope_angle))
+        self.tan_delta_max = math.tan(math.radians(max_gimbal))
+        self.cos_theta_max = math.cos(math.radians(max_angle))
+        self.tan_gamma_gs = math.tan(math.radians(glidelslope_angle))
+        self.max_angle_norm = math.sqrt((1 - self.cos_theta_max) / 2)
 
         # Thrust limits
         self.T_max = 5.0
@@ -93,12 +275,21 @@ class Rocket_Model_6DoF:
 
         self.set_random_initial_state(rng)
 
-        self.x_init = np.concatenate(
-            ((self.m_wet,), self.r_I_init, self.v_I_init, self.q_B_I_init, self.w_B_init))
-        self.x_final = np.concatenate(
-            ((self.m_dry,), self.r_I_final, self.v_I_final, self.q_B_I_final, self.w_B_final))
-
-        self.r_scale = np.linalg.norm(self.r_I_init)
+        self.x_init = np.empty(self.n_x)
+        self.x_init[0] = self.m_wet
+        self.x_init[1:4] = self.r_I_init
+        self.x_init[4:7] = self.v_I_init
+        self.x_init[7:11] = self.q_B_I_init
+        self.x_init[11:14] = self.w_B_init
+
+        self.x_final = np.empty(self.n_x)
+        self.x_final[0] = self.m_dry
+        self.x_final[1:4] = self.r_I_final
+        self.x_final[4:7] = self.v_I_final
+        self.x_final[7:11] = self.q_B_I_final
+        self.x_final[11:14] = self.w_B_final
+
+        self.r_scale = math.hypot(*self.r_I_init)
         self.m_scale = self.m_wet
 
     def set_random_initial_state(self, rng):
@@ -114,136 +305,105 @@ class Rocket_Model_6DoF:
         self.v_I_init[1:3] = rng.uniform(-0.5, -0.2,
                                          size=2) * self.r_I_init[1:3]
 
-        self.q_B_I_init = self.euler_to_quat((0,
-                                              rng.uniform(-30, 30),
-                                              rng.uniform(-30, 30)))
-        self.w_B_init = np.deg2rad((0,
-                                    rng.uniform(-20, 20),
-                                    rng.uniform(-20, 20)))
+        self.q_B_I_init = np.empty(4)
+        self.euler_to_quat(np.array((0.,
+                                     rng.uniform(-30, 30),
+                                     rng.uniform(-30, 30))),
+                           self.q_B_I_init)
+        self.w_B_init = np.array((0.,
+                                  math.radians(rng.uniform(-20, 20)),
+                                  math.radians(rng.uniform(-20, 20))))
 
     def f_func(self, x, u):
-        m, _, _, _, vx, vy, vz, q0, q1, q2, q3, wx, wy, wz = x[0], x[1], x[
-            2], x[3], x[4], x[5], x[6], x[7], x[8], x[9], x[10], x[11], x[12], x[13]
-        ux, uy, uz = u[0], u[1], u[2]
-
-        return np.array([
-            [-0.01 * np.sqrt(ux**2 + uy**2 + uz**2)],
-            [vx],
-            [vy],
-            [vz],
-            [(-1.0 * m - ux * (2 * q2**2 + 2 * q3**2 - 1) - 2 * uy
-              * (q0 * q3 - q1 * q2) + 2 * uz * (q0 * q2 + q1 * q3)) / m],
-            [(2 * ux * (q0 * q3 + q1 * q2) - uy * (2 * q1**2
-                                                   + 2 * q3**2 - 1) - 2 * uz * (q0 * q1 - q2 * q3)) / m],
-            [(-2 * ux * (q0 * q2 - q1 * q3) + 2 * uy
-              * (q0 * q1 + q2 * q3) - uz * (2 * q1**2 + 2 * q2**2 - 1)) / m],
-            [-0.5 * q1 * wx - 0.5 * q2 * wy - 0.5 * q3 * wz],
-            [0.5 * q0 * wx + 0.5 * q2 * wz - 0.5 * q3 * wy],
-            [0.5 * q0 * wy - 0.5 * q1 * wz + 0.5 * q3 * wx],
-            [0.5 * q0 * wz + 0.5 * q1 * wy - 0.5 * q2 * wx],
-            [0],
-            [1.0 * uz],
-            [-1.0 * uy]
-        ])
+        return self._dynamics(x, u)[0].reshape((self.n_x, 1))
 
     def A_func(self, x, u):
-        m, _, _, _, _, _, _, q0, q1, q2, q3, wx, wy, wz = x[0], x[1], x[
-            2], x[3], x[4], x[5], x[6], x[7], x[8], x[9], x[10], x[11], x[12], x[13]
-        ux, uy, uz = u[0], u[1], u[2]
-
-        return np.array([
-            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-            [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-            [0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0],
-            [0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0],
-            [(ux * (2 * q2**2 + 2 * q3**2 - 1) + 2 * uy * (q0 * q3 - q1 * q2) - 2 * uz * (q0 * q2 + q1 * q3)) / m**2, 0, 0, 0, 0, 0, 0, 2 * (q2 * uz
-                                                                                                                                             - q3 * uy) / m, 2 * (q2 * uy + q3 * uz) / m, 2 * (q0 * uz + q1 * uy - 2 * q2 * ux) / m, 2 * (-q0 * uy + q1 * uz - 2 * q3 * ux) / m, 0, 0, 0],
-            [(-2 * ux * (q0 * q3 + q1 * q2) + uy * (2 * q1**2 + 2 * q3**2 - 1) + 2 * uz * (q0 * q1 - q2 * q3)) / m**2, 0, 0, 0, 0, 0, 0, 2 * (-q1 * uz
-                                                                                                                                              + q3 * ux) / m, 2 * (-q0 * uz - 2 * q1 * uy + q2 * ux) / m, 2 * (q1 * ux + q3 * uz) / m, 2 * (q0 * ux + q2 * uz - 2 * q3 * uy) / m, 0, 0, 0],
-            [(2 * ux * (q0 * q2 - q1 * q3) - 2 * uy * (q0 * q1 + q2 * q3) + uz * (2 * q1**2 + 2 * q2**2 - 1)) / m**2, 0, 0, 0, 0, 0, 0, 2 * (q1 * uy
-                                                                                                                                             - q2 * ux) / m, 2 * (q0 * uy - 2 * q1 * uz + q3 * ux) / m, 2 * (-q0 * ux - 2 * q2 * uz + q3 * uy) / m, 2 * (q1 * ux + q2 * uy) / m, 0, 0, 0],
-            [0, 0, 0, 0, 0, 0, 0, 0, -0.5 * wx, -0.5 * wy,
-             - 0.5 * wz, -0.5 * q1, -0.5 * q2, -0.5 * q3],
-            [0, 0, 0, 0, 0, 0, 0, 0.5 * wx, 0, 0.5 * wz,
-             - 0.5 * wy, 0.5 * q0, -0.5 * q3, 0.5 * q2],
-            [0, 0, 0, 0, 0, 0, 0, 0.5 * wy, -0.5 * wz, 0,
-             0.5 * wx, 0.5 * q3, 0.5 * q0, -0.5 * q1],
-            [0, 0, 0, 0, 0, 0, 0, 0.5 * wz, 0.5 * wy,
-             - 0.5 * wx, 0, -0.5 * q2, 0.5 * q1, 0.5 * q0],
-            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
-            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
+        return self._dynamics(x, u)[1]
 
     def B_func(self, x, u):
-        m, _, _, _, _, _, _, q0, q1, q2, q3, _, _, _ = x[0], x[1], x[
-            2], x[3], x[4], x[5], x[6], x[7], x[8], x[9], x[10], x[11], x[12], x[13]
-        ux, uy, uz = u[0], u[1], u[2]
-
-        return np.array([
-            [-0.01 * ux / np.sqrt(ux**2 + uy**2 + uz**2),
-             -0.01 * uy / np.sqrt(ux ** 2 + uy**2 + uz**2),
-             -0.01 * uz / np.sqrt(ux**2 + uy**2 + uz**2)],
-            [0, 0, 0],
-            [0, 0, 0],
-            [0, 0, 0],
-            [(-2 * q2**2 - 2 * q3**2 + 1) / m, 2
-             * (-q0 * q3 + q1 * q2) / m, 2 * (q0 * q2 + q1 * q3) / m],
-            [2 * (q0 * q3 + q1 * q2) / m, (-2 * q1**2 - 2
-                                           * q3**2 + 1) / m, 2 * (-q0 * q1 + q2 * q3) / m],
-            [2 * (-q0 * q2 + q1 * q3) / m, 2 * (q0 * q1 + q2 * q3)
-             / m, (-2 * q1**2 - 2 * q2**2 + 1) / m],
-            [0, 0, 0],
-            [0, 0, 0],
-            [0, 0, 0],
-            [0, 0, 0],
-            [0, 0, 0],
-            [0, 0, 1.0],
-            [0, -1.0, 0]
-        ])
-
-    def euler_to_quat(self, a):
-        a = np.deg2rad(a)
-
-        cy = np.cos(a[1] * 0.5)
-        sy = np.sin(a[1] * 0.5)
-        cr = np.cos(a[0] * 0.5)
-        sr = np.sin(a[0] * 0.5)
-        cp = np.cos(a[2] * 0.5)
-        sp = np.sin(a[2] * 0.5)
+        return self._dynamics(x, u)[2]
+
+    def _dynamics(self, x, u):
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        u = np.ascontiguousarray(u, dtype=np.float64)
+        f = np.empty(self.n_x)
+        A = np.zeros((self.n_x, self.n_x))
+        B = np.zeros((self.n_x, self.n_u))
+        dynamics_core(x, u, f, A, B)
+        return f, A, B
+
+    @staticmethod
+    @njit(cache=True)
+    def euler_to_quat(a, q):
+        """
+        Convert Euler angles in degrees into the quaternion q.
+        """
+        ha0 = 0.5 * math.radians(a[0])
+        ha1 = 0.5 * math.radians(a[1])
+        ha2 = 0.5 * math.radians(a[2])
 
-        q = np.zeros(4)
+        cy = math.cos(ha1)
+        sy = math.sin(ha1)
+        cr = math.cos(ha0)
+        sr = math.sin(ha0)
+        cp = math.cos(ha2)
+        sp = math.sin(ha2)
 
         q[0] = cy * cr * cp + sy * sr * sp
         q[1] = cy * sr * cp - sy * cr * sp
-        q[3] = cy * cr * sp + sy * sr * cp
         q[2] = sy * cr * cp - cy * sr * sp
+        q[3] = cy * cr * sp + sy * sr * cp
 
-        return q
-
-    def skew(self, v):
-        return np.array([
-            [0, -v[2], v[1]],
-            [v[2], 0, -v[0]],
-            [-v[1], v[0], 0]
-        ])
-
-    def dir_cosine(self, q):
-        return np.array([
-            [1 - 2 * (q[2] ** 2 + q[3] ** 2), 2 * (q[1] * q[2]
-                                                   + q[0] * q[3]), 2 * (q[1] * q[3] - q[0] * q[2])],
-            [2 * (q[1] * q[2] - q[0] * q[3]), 1 - 2
-             * (q[1] ** 2 + q[3] ** 2), 2 * (q[2] * q[3] + q[0] * q[1])],
-            [2 * (q[1] * q[3] + q[0] * q[2]), 2 * (q[2] * q[3]
-                                                   - q[0] * q[1]), 1 - 2 * (q[1] ** 2 + q[2] ** 2)]
-        ])
-
-    def omega(self, w):
-        return np.array([
-            [0, -w[0], -w[1], -w[2]],
-            [w[0], 0, w[2], -w[1]],
-            [w[1], -w[2], 0, w[0]],
-            [w[2], w[1], -w[0], 0],
-        ])
+    @staticmethod
+    @njit(cache=True)
+    def skew(v, out):
+        out[0, 0] = 0.
+        out[0, 1] = -v[2]
+        out[0, 2] = v[1]
+        out[1, 0] = v[2]
+        out[1, 1] = 0.
+        out[1, 2] = -v[0]
+        out[2, 0] = -v[1]
+        out[2, 1] = v[0]
+        out[2, 2] = 0.
+
+    @staticmethod
+    @njit(cache=True)
+    def dir_cosine(q, out):
+        q0, q1, q2, q3 = q[0], q[1], q[2], q[3]
+        q01, q02, q03 = q0 * q1, q0 * q2, q0 * q3
+        q11, q12, q13 = q1 * q1, q1 * q2, q1 * q3
+        q22, q23, q33 = q2 * q2, q2 * q3, q3 * q3
+
+        out[0, 0] = 1. - 2. * (q22 + q33)
+        out[0, 1] = 2. * (q12 + q03)
+        out[0, 2] = 2. * (q13 - q02)
+        out[1, 0] = 2. * (q12 - q03)
+        out[1, 1] = 1. - 2. * (q11 + q33)
+        out[1, 2] = 2. * (q23 + q01)
+        out[2, 0] = 2. * (q13 + q02)
+        out[2, 1] = 2. * (q23 - q01)
+        out[2, 2] = 1. - 2. * (q11 + q22)
+
+    @staticmethod
+    @njit(cache=True)
+    def omega(w, out):
+        out[0, 0] = 0.
+        out[0, 1] = -w[0]
+        out[0, 2] = -w[1]
+        out[0, 3] = -w[2]
+        out[1, 0] = w[0]
+        out[1, 1] = 0.
+        out[1, 2] = w[2]
+        out[1, 3] = -w[1]
+        out[2, 0] = w[1]
+        out[2, 1] = -w[2]
+        out[2, 2] = 0.
+        out[2, 3] = w[0]
+        out[3, 0] = w[2]
+        out[3, 1] = w[1]
+        out[3, 2] = -w[0]
+        out[3, 3] = 0.
 
     def initialize_trajectory(self, X, U):
         """
@@ -251,29 +411,23 @@ class Rocket_Model_6DoF:
         """
         K = X.shape[1]
 
-        for k in range(K):
-            alpha1 = (K - k) / K
-            alpha2 = k / K
-
-            m_k = (alpha1 * self.x_init[0] + alpha2 * self.x_final[0],)
-            r_I_k = alpha1 * self.x_init[1:4] + alpha2 * self.x_final[1:4]
-            v_I_k = alpha1 * self.x_init[4:7] + alpha2 * self.x_final[4:7]
-            q_B_I_k = np.array([1, 0, 0, 0])
-            w_B_k = alpha1 * self.x_init[11:14] + alpha2 * self.x_final[11:14]
+        alpha2 = np.arange(K) / K
+        alpha1 = 1 - alpha2
 
-            X[:, k] = np.concatenate((m_k, r_I_k, v_I_k, q_B_I_k, w_B_k))
-            U[:, k] = m_k * -self.g_I
+        X[:, :] = np.outer(self.x_init, alpha1) + \
+            np.outer(self.x_final, alpha2)
+        X[7:11, :] = np.array([1, 0, 0, 0])[:, None]
+        U[:, :] = np.outer(-self.g_I, X[0, :])
 
         return X, U
 
-    def get_constraints(self, X_v, U_v, X_last_p, U_last_p):
+    def get_constraints(self, X_v, U_v, U_last_hat_p):
         """
         Get model specific constraints.
 
         :param X_v: cvx variable for current states
         :param U_v: cvx variable for current inputs
-        :param X_last_p: cvx parameter for last states
-        :param U_last_p: cvx parameter for last inputs
+        :param U_last_hat_p: cvx parameter for last inputs normalized per column
         :return: A list of cvx constraints
         """
         # Boundary conditions:
@@ -294,8 +448,7 @@ class Rocket_Model_6DoF:
             X_v[0, :] >= self.m_dry,  # minimum mass
             cvxpy.norm(X_v[2: 4, :], axis=0) <= X_v[1, :] / \
             self.tan_gamma_gs,  # glideslope
-            cvxpy.norm(X_v[9:11, :], axis=0) <= np.sqrt(
-                (1 - self.cos_theta_max) / 2),  # maximum angle
+            cvxpy.norm(X_v[9:11, :], axis=0) <= self.max_angle_norm,  # maximum angle
             # maximum angular velocity
             cvxpy.norm(X_v[11: 14, :], axis=0) <= self.w_B_max,
 
@@ -306,15 +459,174 @@ class Rocket_Model_6DoF:
         ]
 
         # linearized lower thrust constraint
-        rhs = [U_last_p[:, k] / cvxpy.norm(U_last_p[:, k]) @ U_v[:, k]
-               for k in range(X_v.shape[1])]
         constraints += [
-            self.T_min <= cvxpy.vstack(rhs)
+            cvxpy.sum(cvxpy.multiply(U_last_hat_p, U_v), axis=0) >= self.T_min
         ]
 
         return constraints
 
 
+@njit(cache=True)
+def V_layout(n_x, n_u):
+    """
+    Block boundaries of the augmented state V = [x, Phi_A, B_bar, C_bar, S_bar, z_bar].
+
+    :param n_x: Number of states
+    :param n_u: Number of inputs
+    :return: End indices of the x, Phi_A, B_bar, C_bar, S_bar and z_bar blocks
+    """
+    x_end = n_x
+    A_bar_end = x_end + n_x * n_x
+    B_bar_end = A_bar_end + n_x * n_u
+    C_bar_end = B_bar_end + n_x * n_u
+    S_bar_end = C_bar_end + n_x
+    z_bar_end = S_bar_end + n_x
+    return x_end, A_bar_end, B_bar_end, C_bar_end, S_bar_end, z_bar_end
+
+
+@njit(cache=True, fastmath=True)
+def ode_dVdt(V, t, u_t0, u_t1, sigma, dt, u, f, A, B, dVdt):
+    """
+    ODE function to compute dVdt.
+
+    :param V: Evaluation state V = [x, Phi_A, B_bar, C_bar, S_bar, z_bar]
+    :param t: Evaluation time
+    :param u_t0: Input at start of interval
+    :param u_t1: Input at end of interval
+    :param sigma: Total time
+    :param dt: Length of the interval
+    :param u, f, A, B: Scratch buffers for the input, dynamics and Jacobians,
+        A and B zero-initialized
+    :param dVdt: Output buffer for the derivative at current time and state
+    """
+    n_x = f.shape[0]
+    n_u = u.shape[0]
+    _, A_bar_end, B_bar_end, C_bar_end, S_bar_end, _ = V_layout(n_x, n_u)
+
+    alpha = (dt - t) / dt
+    beta = t / dt
+    x = V[:n_x]
+    for i in range(n_u):
+        u[i] = u_t0[i] + beta * (u_t1[i] - u_t0[i])
+
+    # B_bar = \Phi_A(t,\tau_k) \int \Phi_A(\xi,\tau_k)^{-1} B(\xi) \alpha(\xi) d\xi
+    # (and likewise C_bar, S_bar, z_bar) obeys the same linear ODE as \Phi_A,
+    # d/dt B_bar = A B_bar + \alpha B, so no inverse of \Phi_A is needed
+    Phi_A = V[n_x:A_bar_end].reshape((n_x, n_x))
+    B_bar = V[A_bar_end:B_bar_end].reshape((n_x, n_u))
+    C_bar = V[B_bar_end:C_bar_end].reshape((n_x, n_u))
+    S_bar = V[C_bar_end:S_bar_end]
+    z_bar = V[S_bar_end:]
+
+    dPhi_A = dVdt[n_x:A_bar_end].reshape((n_x, n_x))
+    dB_bar = dVdt[A_bar_end:B_bar_end].reshape((n_x, n_u))
+    dC_bar = dVdt[B_bar_end:C_bar_end].reshape((n_x, n_u))
+    dS_bar = dVdt[C_bar_end:S_bar_end]
+    dz_bar = dVdt[S_bar_end:]
+
+    # the structural zeros of A and B are never written, so scaling in place
+    # keeps them zero for the next call
+    dynamics_core(x, u, f, A, B)
+    A *= sigma
+    B *= sigma
+
+    A_dot(A, Phi_A, dPhi_A)
+    A_dot(A, B_bar, dB_bar)
+    A_dot(A, C_bar, dC_bar)
+    A_dot(A, S_bar.reshape((n_x, 1)), dS_bar.reshape((n_x, 1)))
+    A_dot(A, z_bar.reshape((n_x, 1)), dz_bar.reshape((n_x, 1)))
+
+    for i in range(n_x):
+        dVdt[i] = sigma * f[i]
+        dS_bar[i] += f[i]
+        for j in range(n_u):
+            dB_bar[i, j] += alpha * B[i, j]
+            dC_bar[i, j] += beta * B[i, j]
+
+    # f is no longer needed, reuse it for A @ x
+    A_dot(A, x.reshape((n_x, 1)), f.reshape((n_x, 1)))
+    for i in range(n_x):
+        z_t = -f[i]
+        for j in range(n_u):
+            z_t -= B[i, j] * u[j]
+        dz_bar[i] += z_t
+
+
+@njit(cache=True, fastmath=True)
+def integrate_segment(V, u_t0, u_t1, sigma, dt, n_x, n_steps):
+    """
+    Integrate the augmented ODE over one segment with fixed-step RK4.
+
+    :param V: Value of V at the start of the segment, overwritten with
+        the value at the end of the segment
+    :param u_t0: Input at start of interval
+    :param u_t1: Input at end of interval
+    :param sigma: Total time
+    :param dt: Length of the interval
+    :param n_x: Number of states
+    :param n_steps: Number of RK4 steps
+    """
+    n_V = V.shape[0]
+    n_u = u_t0.shape[0]
+    h = dt / n_steps
+
+    # scratch buffers shared by all right-hand side evaluations
+    u = np.empty(n_u)
+    f = np.empty(n_x)
+    A = np.zeros((n_x, n_x))
+    B = np.zeros((n_x, n_u))
+    V_tmp = np.empty(n_V)
+    k1 = np.empty(n_V)
+    k2 = np.empty(n_V)
+    k3 = np.empty(n_V)
+    k4 = np.empty(n_V)
+
+    t = 0.
+    for _ in range(n_steps):
+        ode_dVdt(V, t, u_t0, u_t1, sigma, dt, u, f, A, B, k1)
+        for i in range(n_V):
+            V_tmp[i] = V[i] + 0.5 * h * k1[i]
+        ode_dVdt(V_tmp, t + 0.5 * h, u_t0, u_t1, sigma, dt, u, f, A, B, k2)
+        for i in range(n_V):
+            V_tmp[i] = V[i] + 0.5 * h * k2[i]
+        ode_dVdt(V_tmp, t + 0.5 * h, u_t0, u_t1, sigma, dt, u, f, A, B, k3)
+        for i in range(n_V):
+            V_tmp[i] = V[i] + h * k3[i]
+        ode_dVdt(V_tmp, t + h, u_t0, u_t1, sigma, dt, u, f, A, B, k4)
+        for i in range(n_V):
+            V[i] += h / 6. * (k1[i] + 2. * k2[i] + 2. * k3[i] + k4[i])
+        t += h
+
+
+@njit(cache=True, parallel=True)
+def discretize(V0, X, U_T, sigma, dt, n_steps, A_bar, B_bar, C_bar, S_bar, z_bar):
+    """
+    Integrate all segments in parallel and write the discretization matrices.
+
+    :param V0: Initial value of V with the state part left to be filled in
+    :param X: Matrix of states for all time points
+    :param U_T: Matrix of inputs for all time points, one row per time point
+    :param sigma: Total time
+    :param dt: Length of one segment
+    :param n_steps: Number of RK4 steps per segment
+    :param A_bar, B_bar, C_bar, S_bar, z_bar: Output discretization matrices
+    """
+    n_x = X.shape[0]
+    n_u = U_T.shape[1]
+    _, A_bar_end, B_bar_end, C_bar_end, S_bar_end, _ = V_layout(n_x, n_u)
+
+    for k in prange(X.shape[1] - 1):
+        V = V0.copy()
+        V[:n_x] = X[:, k]
+        integrate_segment(V, U_T[k], U_T[k + 1], sigma, dt, n_x, n_steps)
+
+        A_bar[:, :, k] = V[n_x:A_bar_end].reshape((n_x, n_x))
+        B_bar[:, :, k] = V[A_bar_end:B_bar_end].reshape((n_x, n_u))
+        C_bar[:, :, k] = V[B_bar_end:C_bar_end].reshape((n_x, n_u))
+        S_bar[:, k] = V[C_bar_end:S_bar_end]
+        z_bar[:, k] = V[S_bar_end:]
+
+
 class Integrator:
     def __init__(self, m, K):
         self.K = K
@@ -322,34 +634,23 @@ class Integrator:
         self.n_x = m.n_x
         self.n_u = m.n_u
 
-        self.A_bar = np.zeros([m.n_x * m.n_x, K - 1])
-        self.B_bar = np.zeros([m.n_x * m.n_u, K - 1])
-        self.C_bar = np.zeros([m.n_x * m.n_u, K - 1])
-        self.S_bar = np.zeros([m.n_x, K - 1])
-        self.z_bar = np.zeros([m.n_x, K - 1])
-
-        # vector indices for flat matrices
-        x_end = m.n_x
-        A_bar_end = m.n_x * (1 + m.n_x)
-        B_bar_end = m.n_x * (1 + m.n_x + m.n_u)
-        C_bar_end = m.n_x * (1 + m.n_x + m.n_u + m.n_u)
-        S_bar_end = m.n_x * (1 + m.n_x + m.n_u + m.n_u + 1)
-        z_bar_end = m.n_x * (1 + m.n_x + m.n_u + m.n_u + 2)
-        self.x_ind = slice(0, x_end)
-        self.A_bar_ind = slice(x_end, A_bar_end)
-        self.B_bar_ind = slice(A_bar_end, B_bar_end)
-        self.C_bar_ind = slice(B_bar_end, C_bar_end)
-        self.S_bar_ind = slice(C_bar_end, S_bar_end)
-        self.z_bar_ind = slice(S_bar_end, z_bar_end)
-
-        self.f, self.A, self.B = m.f_func, m.A_func, m.B_func
-
-        # integration initial condition
-        self.V0 = np.zeros((m.n_x * (1 + m.n_x + m.n_u + m.n_u + 2),))
-        self.V0[self.A_bar_ind] = np.eye(m.n_x).reshape(-1)
+        # one column-major matrix per segment, stacked along the last axis
+        self.A_bar = np.zeros((m.n_x, m.n_x, K - 1), order='F')
+        self.B_bar = np.zeros((m.n_x, m.n_u, K - 1), order='F')
+        self.C_bar = np.zeros((m.n_x, m.n_u, K - 1), order='F')
+        self.S_bar = np.zeros((m.n_x, K - 1), order='F')
+        self.z_bar = np.zeros((m.n_x, K - 1), order='F')
+
+        # integration initial condition, \Phi_A starts at identity
+        x_end, A_bar_end, _, _, _, z_bar_end = V_layout(m.n_x, m.n_u)
+        self.V0 = np.zeros(z_bar_end)
+        self.V0[x_end:A_bar_end] = np.eye(m.n_x).reshape(-1)
 
         self.dt = 1. / (K - 1)
 
+        # fixed RK4 steps per segment, enough for the smooth augmented ODE
+        self.n_steps = 8
+
     def calculate_discretization(self, X, U, sigma):
         """
         Calculate discretization for given states, inputs and total time.
@@ -359,11 +660,281 @@ class Integrator:
         :param sigma: Total time
         :return: The discretization matrices
         """
-        for k in range(self.K - 1):
-            self.V0[self.x_ind] = X[:, k]
-            V = np.array(odeint(self._ode_dVdt, self.V0, (0, self.dt),
-                                args=(U[:, k], U[:, k + 1], sigma))[1, :])
-
-            # using \Phi_A(\tau_{k+1},\xi) = \Phi_A(\tau_{k+1},\tau_k)\Phi_A(\xi,\tau_k)^{-1}
-            # flatten matrices in column-major (Fortran) order for CVXPY
-            Phi = V[self.A_bar_ind].reshape((self.n_
+        # contiguous rows of inputs so the jitted integrator sees plain 1-D arrays
+        U_T = np.ascontiguousarray(U.T, dtype=np.float64)
+
+        X = np.asarray(X, dtype=np.float64)
+        sigma = float(sigma)
+
+        # the segments are independent, so they are integrated in parallel
+        discretize(self.V0, X, U_T, sigma, self.dt, self.n_steps,
+                   self.A_bar, self.B_bar, self.C_bar, self.S_bar, self.z_bar)
+
+        return self.A_bar, self.B_bar, self.C_bar, self.S_bar, self.z_bar
+
+
+class SCP_Problem:
+    """
+    Defines a standard Successive Convexification problem and
+      adds the model specific constraints and objectives.
+
+    :param m: The model object
+    :param K: Number of discretization points
+    """
+
+    def __init__(self, m, K):
+        # Variables:
+        self.var = dict()
+        self.var['X'] = cvxpy.Variable((m.n_x, K))
+        self.var['U'] = cvxpy.Variable((m.n_u, K))
+        self.var['sigma'] = cvxpy.Variable(nonneg=True)
+        self.var['nu'] = cvxpy.Variable((m.n_x, K - 1))
+        self.var['delta_norm'] = cvxpy.Variable(nonneg=True)
+        self.var['sigma_norm'] = cvxpy.Variable(nonneg=True)
+
+        # Parameters:
+        self.par = dict()
+        self.par['A_bar'] = cvxpy.Parameter((m.n_x * m.n_x, K - 1))
+        self.par['B_bar'] = cvxpy.Parameter((m.n_x * m.n_u, K - 1))
+        self.par['C_bar'] = cvxpy.Parameter((m.n_x * m.n_u, K - 1))
+        self.par['S_bar'] = cvxpy.Parameter((m.n_x, K - 1))
+        self.par['z_bar'] = cvxpy.Parameter((m.n_x, K - 1))
+
+        self.par['X_last'] = cvxpy.Parameter((m.n_x, K))
+        self.par['U_last'] = cvxpy.Parameter((m.n_u, K))
+        self.par['U_last_hat'] = cvxpy.Parameter((m.n_u, K))
+        self.par['sigma_last'] = cvxpy.Parameter(nonneg=True)
+
+        self.par['weight_sigma'] = cvxpy.Parameter(nonneg=True)
+        self.par['weight_delta'] = cvxpy.Parameter(nonneg=True)
+        self.par['weight_delta_sigma'] = cvxpy.Parameter(nonneg=True)
+        self.par['weight_nu'] = cvxpy.Parameter(nonneg=True)
+
+        # Constraints:
+        constraints = []
+
+        # Model:
+        constraints += m.get_constraints(
+            self.var['X'], self.var['U'], self.par['U_last_hat'])
+
+        # Dynamics:
+        # x_t+1 = A_*x_t+B_*U_t+C_*U_T+1*S_*sigma+zbar+nu
+        constraints += [
+            self.var['X'][:, k + 1] ==
+            cvxpy.reshape(self.par['A_bar'][:, k], (m.n_x, m.n_x), order='F') @
+            self.var['X'][:, k] +
+            cvxpy.reshape(self.par['B_bar'][:, k], (m.n_x, m.n_u), order='F') @
+            self.var['U'][:, k] +
+            cvxpy.reshape(self.par['C_bar'][:, k], (m.n_x, m.n_u), order='F') @
+            self.var['U'][:, k + 1] +
+            self.par['S_bar'][:, k] * self.var['sigma'] +
+            self.par['z_bar'][:, k] +
+            self.var['nu'][:, k]
+            for k in range(K - 1)
+        ]
+
+        # Trust regions:
+        dx = cvxpy.sum(cvxpy.square(
+            self.var['X'] - self.par['X_last']), axis=0)
+        du = cvxpy.sum(cvxpy.square(
+            self.var['U'] - self.par['U_last']), axis=0)
+        ds = self.var['sigma'] - self.par['sigma_last']
+        constraints += [cvxpy.norm(dx + du, 1) <= self.var['delta_norm']]
+        constraints += [cvxpy.norm(ds, 'inf') <= self.var['sigma_norm']]
+
+        # Flight time positive:
+        constraints += [self.var['sigma'] >= 0.1]
+
+        # Objective:
+        sc_objective = cvxpy.Minimize(
+            self.par['weight_sigma'] * self.var['sigma'] +
+            self.par['weight_nu'] * cvxpy.norm(self.var['nu'], 'inf') +
+            self.par['weight_delta'] * self.var['delta_norm'] +
+            self.par['weight_delta_sigma'] * self.var['sigma_norm']
+        )
+
+        objective = sc_objective
+
+        self.prob = cvxpy.Problem(objective, constraints)
+
+    def set_parameters(self, **kwargs):
+        """
+        All parameters have to be filled before calling solve().
+        Takes the following arguments as keywords:
+
+        A_bar
+        B_bar
+        C_bar
+        S_bar
+        z_bar
+        X_last
+        U_last
+        U_last_hat
+        sigma_last
+        E
+        weight_sigma
+        weight_nu
+        radius_trust_region
+        """
+
+        for key in kwargs:
+            if key in self.par:
+                self.par[key].value = kwargs[key]
+            else:
+                print(f'Parameter \'{key}\' does not exist.')
+
+    def get_variable(self, name):
+        if name in self.var:
+            return self.var[name].value
+        else:
+            print(f'Variable \'{name}\' does not exist.')
+            return None
+
+    def solve(self, **kwargs):
+        error = False
+        try:
+            with warnings.catch_warnings():  # For User warning from solver
+                warnings.simplefilter('ignore')
+                self.prob.solve(verbose=verbose_solver,
+                                solver=solver, warm_start=True)
+        except cvxpy.SolverError:
+            error = True
+
+        stats = self.prob.solver_stats
+
+        info = {
+            'setup_time': stats.setup_time,
+            'solver_time': stats.solve_time,
+            'iterations': stats.num_iters,
+            'solver_error': error
+        }
+
+        return info
+
+
+def axis3d_equal(X, Y, Z, ax):
+
+    max_range = np.array([X.max() - X.min(), Y.max()
+                          - Y.min(), Z.max() - Z.min()]).max()
+    Xb = 0.5 * max_range * np.mgrid[-1:2:2, -1:2:2,
+                                    -1:2:2][0].flatten() + 0.5 * (X.max() + X.min())
+    Yb = 0.5 * max_range * np.mgrid[-1:2:2, -1:2:2,
+                                    -1:2:2][1].flatten() + 0.5 * (Y.max() + Y.min())
+    Zb = 0.5 * max_range * np.mgrid[-1:2:2, -1:2:2,
+                                    -1:2:2][2].flatten() + 0.5 * (Z.max() + Z.min())
+    # Comment or uncomment following both lines to test the fake bounding box:
+    for xb, yb, zb in zip(Xb, Yb, Zb):
+        ax.plot([xb], [yb], [zb], 'w')
+
+
+def plot_animation(X, U):  # pragma: no cover
+
+    fig = plt.figure()
+    ax = fig.add_subplot(projection='3d')
+    # for stopping simulation with the esc key.
+    fig.canvas.mpl_connect('key_release_event',
+            lambda event: [exit(0) if event.key == 'escape' else None])
+
+    for k in range(K):
+        plt.cla()
+        ax.plot(X[2, :], X[3, :], X[1, :])  # trajectory
+        ax.scatter3D([0.0], [0.0], [0.0], c="r",
+                     marker="x")  # target landing point
+        axis3d_equal(X[2, :], X[3, :], X[1, :], ax)
+
+        rx, ry, rz = X[1:4, k]
+        # vx, vy, vz = X[4:7, k]
+        qw, qx, qy, qz = X[7:11, k]
+
+        CBI = np.array([
+            [1 - 2 * (qy ** 2 + qz ** 2), 2 * (qx * qy + qw * qz),
+             2 * (qx * qz - qw * qy)],
+            [2 * (qx * qy - qw * qz), 1 - 2
+             * (qx ** 2 + qz ** 2), 2 * (qy * qz + qw * qx)],
+            [2 * (qx * qz + qw * qy), 2 * (qy * qz - qw * qx),
+             1 - 2 * (qx ** 2 + qy ** 2)]
+        ])
+
+        Fx, Fy, Fz = np.dot(np.transpose(CBI), U[:, k])
+        dx, dy, dz = np.dot(np.transpose(CBI), np.array([1., 0., 0.]))
+
+        # attitude vector
+        ax.quiver(ry, rz, rx, dy, dz, dx, length=0.5, linewidth=3.0,
+                  arrow_length_ratio=0.0, color='black')
+
+        # thrust vector
+        ax.quiver(ry, rz, rx, -Fy, -Fz, -Fx, length=0.1,
+                  arrow_length_ratio=0.0, color='red')
+
+        ax.set_title("Rocket powered landing")
+        plt.pause(0.5)
+
+
+def main(rng=None):
+    print("start!!")
+    m = Rocket_Model_6DoF(rng)
+
+    # state and input list
+    X = np.empty(shape=[m.n_x, K])
+    U = np.empty(shape=[m.n_u, K])
+
+    # INITIALIZATION
+    sigma = m.t_f_guess
+    X, U = m.initialize_trajectory(X, U)
+
+    integrator = Integrator(m, K)
+    problem = SCP_Problem(m, K)
+
+    converged = False
+    w_delta = W_DELTA
+    for it in range(iterations):
+        t0_it = time()
+        print('-' * 18 + f' Iteration {str(it + 1).zfill(2)} ' + '-' * 18)
+
+        A_bar, B_bar, C_bar, S_bar, z_bar = integrator.calculate_discretization(
+            X, U, sigma)
+
+        # flatten matrices in column-major (Fortran) order for CVXPY
+        problem.set_parameters(A_bar=A_bar.reshape((-1, K - 1), order='F'),
+                               B_bar=B_bar.reshape((-1, K - 1), order='F'),
+                               C_bar=C_bar.reshape((-1, K - 1), order='F'),
+                               S_bar=S_bar, z_bar=z_bar,
+                               X_last=X, U_last=U,
+                               U_last_hat=U / np.linalg.norm(U, axis=0),
+                               sigma_last=sigma,
+                               weight_sigma=W_SIGMA, weight_nu=W_NU,
+                               weight_delta=w_delta,
+                               weight_delta_sigma=W_DELTA_SIGMA)
+        problem.solve()
+
+        X = problem.get_variable('X')
+        U = problem.get_variable('U')
+        sigma = problem.get_variable('sigma')
+
+        delta_norm = problem.get_variable('delta_norm')
+        sigma_norm = problem.get_variable('sigma_norm')
+        nu_norm = np.linalg.norm(problem.get_variable('nu'), np.inf)
+
+        print('delta_norm', delta_norm)
+        print('sigma_norm', sigma_norm)
+        print('nu_norm', nu_norm)
+
+        if delta_norm < 1e-3 and sigma_norm < 1e-3 and nu_norm < 1e-7:
+            converged = True
+
+        w_delta *= 1.5
+
+        print('Time for iteration', time() - t0_it, 's')
+
+        if converged:
+            print(f'Converged after {it + 1} iterations.')
+            break
+
+    if show_animation:  # pragma: no cover
+        plot_animation(X, U)
+
+    print("done!!")
+
+
+if __name__ == '__main__':
+    main()